@@ -0,0 +1,83 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from sklearn.cluster import DBSCAN
+
+from feature_store import FeatureStore
+from shards import cluster_labels
+
+APPROACHES = ("list-dbscan", "list", "store-float32", "store-float16")
+
+
+def page_features(page, dims, num_templates, seed=0):
+    # Stand-in for VGG16 output: sparse non-negative activations around one of a few page templates.
+    template = np.random.default_rng(seed + page % num_templates).random(dims, dtype=np.float32)
+    template[template < 0.8] = 0
+    noise = np.random.default_rng(seed + 1000003 + page).random(dims, dtype=np.float32) * 0.3
+    return template + noise
+
+
+def run(approach, pages, dims, num_templates, threshold):
+    started = time.monotonic()
+    if approach.startswith("list"):
+        # What the scripts did before: keep every vector on its document, then stack them.
+        processed_data = [{'path': str(page), 'visual_features': page_features(page, dims, num_templates)}
+                          for page in range(pages)]
+        features = np.array([d['visual_features'] for d in processed_data])
+        if approach == "list-dbscan":
+            labels = DBSCAN(metric='cosine', eps=1 - threshold, min_samples=1).fit(features).labels_
+        else:
+            # Same clustering as the store runs, so the difference is storage alone.
+            labels = cluster_labels(features, threshold)
+    else:
+        dtype = np.float16 if approach == "store-float16" else np.float32
+        with tempfile.TemporaryDirectory() as tmp:
+            store = FeatureStore(os.path.join(tmp, "features"), pages, dtype)
+            processed_data = []
+            for page in range(pages):
+                data = {'path': str(page), 'visual_features': page_features(page, dims, num_templates)}
+                store.add(data)
+                processed_data.append(data)
+            store.flush()
+            labels = cluster_labels(store.features, threshold)
+    seconds = time.monotonic() - started
+    return {
+        'approach': approach,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'seconds': seconds,
+        'clusters': int(len(set(labels.tolist()))),
+    }
+
+
+def main(pages, dims, num_templates, threshold):
+    # Each approach runs in a fresh interpreter so ru_maxrss is its own peak.
+    print(f"{pages} pages x {dims} dims, {num_templates} templates, threshold {threshold}")
+    print(f"{'approach':<15} {'peak RSS (MB)':>14} {'seconds':>9} {'clusters':>9}")
+    for approach in APPROACHES:
+        output = subprocess.run([sys.executable, __file__, "--run", approach, "--pages", str(pages),
+                                 "--dims", str(dims), "--templates", str(num_templates),
+                                 "--threshold", str(threshold)],
+                                check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{result['approach']:<15} {result['peak_rss_mb']:>14.1f} {result['seconds']:>9.1f} {result['clusters']:>9}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Peak RSS of building and clustering visual features")
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--dims", type=int, default=25088, help="VGG16 block5 features are 7 * 7 * 512")
+    parser.add_argument("--templates", type=int, default=20)
+    parser.add_argument("--threshold", type=float, default=0.7)
+    parser.add_argument("--run", choices=APPROACHES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        print(json.dumps(run(args.run, args.pages, args.dims, args.templates, args.threshold)))
+    else:
+        main(args.pages, args.dims, args.templates, args.threshold)
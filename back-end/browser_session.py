@@ -0,0 +1,150 @@
+import os
+import shutil
+import time
+from collections import Counter
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+DRIVER_CANDIDATES = [
+    "/usr/bin/chromedriver",
+    "/usr/lib/chromium/chromedriver",
+    "/usr/lib/chromium-browser/chromedriver",
+    "/snap/bin/chromium.chromedriver",
+]
+
+
+def find_chromedriver():
+    """CHROMEDRIVER_PATH, then PATH, then known install locations.
+
+    Returns None when nothing is found, which lets Selenium Manager fetch a
+    matching driver itself.
+    """
+    env_path = os.environ.get("CHROMEDRIVER_PATH")
+    if env_path:
+        return env_path
+    path = shutil.which("chromedriver")
+    if path:
+        return path
+    for candidate in DRIVER_CANDIDATES:
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def report_restarts(restarts, restart_seconds):
+    for reason, count in restarts.most_common():
+        seconds = restart_seconds[reason]
+        print(f"  {reason}: {count} starts, {seconds:.1f}s total, {seconds / count:.2f}s each")
+
+
+def session_memory_mb(driver):
+    # chromedriver plus every Chrome process it spawned; 0 when psutil is unavailable.
+    if psutil is None or driver is None:
+        return 0
+    try:
+        process = psutil.Process(driver.service.process.pid)
+        processes = [process, *process.children(recursive=True)]
+        return sum(p.memory_info().rss for p in processes) / (1024 * 1024)
+    except (psutil.Error, AttributeError):
+        return 0
+
+
+def is_healthy(driver):
+    if driver is None:
+        return True
+    try:
+        return driver.execute_script("return 1") == 1
+    except Exception:
+        return False
+
+
+class BrowserSessionManager:
+    """Keeps one warm VisualAnalyzer and replaces it before or after it goes bad.
+
+    Sessions are recycled after ``max_pages`` pages, when the browser's memory
+    passes ``max_memory_mb``, or when a health check fails; the last two are
+    checked every ``check_every`` pages. Restart counts and cold-start time are
+    kept per reason for ``report``.
+    """
+
+    def __init__(self, factory, max_pages=200, max_memory_mb=2048, check_every=10):
+        self.factory = factory
+        self.max_pages = max_pages
+        self.max_memory_mb = max_memory_mb
+        self.check_every = check_every
+        self.current = None
+        self._next_reason = "startup"
+        self.pages = 0
+        self.total_pages = 0
+        self.retried = 0
+        self.recovered = 0
+        self.restarts = Counter()
+        self.restart_seconds = Counter()
+        if max_memory_mb and psutil is None:
+            print("Warning: psutil is not installed, so the browser session memory limit is not enforced")
+
+    def restart(self, reason):
+        # The replacement starts on the next acquire, so a final failed page costs no cold start.
+        if self.current is not None:
+            try:
+                self.current.close()
+            except Exception as e:
+                print(f"Error closing browser session: {str(e)}")
+        self.current = None
+        self._next_reason = reason
+
+    def acquire(self):
+        if self.current is not None:
+            if self.pages >= self.max_pages:
+                self.restart("page limit")
+            elif self.pages % self.check_every == 0 and self.pages:
+                driver = self.current.driver
+                if not is_healthy(driver):
+                    self.restart("health check")
+                elif self.max_memory_mb and session_memory_mb(driver) > self.max_memory_mb:
+                    self.restart("memory")
+        if self.current is None:
+            started = time.monotonic()
+            self.current = self.factory()
+            self.restarts[self._next_reason] += 1
+            self.restart_seconds[self._next_reason] += time.monotonic() - started
+            self.pages = 0
+        self.pages += 1
+        self.total_pages += 1
+        return self.current
+
+    def run(self, file_path, work, retries=1):
+        """Call ``work(visual_analyzer)``; a failure or None result retries on a fresh session."""
+        for attempt in range(retries + 1):
+            if attempt:
+                print(f"Retrying {file_path} on a fresh browser session...")
+                self.retried += 1
+            try:
+                result = work(self.acquire())
+                reason = "capture failed"
+            except Exception as e:
+                print(f"Error processing {file_path}: {str(e)}")
+                result = None
+                reason = "error"
+            if result is not None:
+                if attempt:
+                    self.recovered += 1
+                return result
+            self.restart(reason)
+        return None
+
+    def report(self):
+        restarts = sum(self.restarts.values()) - self.restarts["startup"]
+        rate = 100 * restarts / self.total_pages if self.total_pages else 0
+        print(f"Browser sessions: {self.total_pages} page attempts, {restarts} restarts ({rate:.1f} per 100 attempts), "
+              f"{self.recovered}/{self.retried} retried pages recovered")
+        report_restarts(self.restarts, self.restart_seconds)
+
+    def close(self):
+        self.report()
+        if self.current is not None:
+            self.current.close()
+            self.current = None
@@ -0,0 +1,355 @@
+import asyncio
+import base64
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+
+import websockets
+from PIL import Image
+
+from browser_session import report_restarts
+
+CHROME_CANDIDATES = ["google-chrome", "google-chrome-stable", "chromium", "chromium-browser", "chrome"]
+
+BROWSER_ARGS = [
+    '--headless=new',
+    '--disable-gpu',
+    '--ignore-certificate-errors',
+    '--allow-insecure-localhost',
+    '--disable-web-security',
+    '--disable-dev-shm-usage',
+    '--disable-extensions',
+    '--no-sandbox',
+    '--no-first-run',
+    '--no-default-browser-check',
+    '--remote-debugging-port=0',
+]
+
+
+class CDPError(Exception):
+    pass
+
+
+def find_chrome_binary():
+    env_path = os.environ.get("CHROME_PATH")
+    if env_path:
+        return env_path
+    for name in CHROME_CANDIDATES:
+        path = shutil.which(name)
+        if path:
+            return path
+    raise FileNotFoundError("Chrome binary not found, set CHROME_PATH")
+
+
+class _Connection:
+    """One websocket to a browser; tabs talk over it through flattened sessions."""
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.closed = False
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._waiters = defaultdict(list)
+        self._reader = asyncio.ensure_future(self._read_loop())
+
+    async def _read_loop(self):
+        try:
+            async for raw in self.ws:
+                message = json.loads(raw)
+                if 'id' in message:
+                    _, future = self._pending.pop(message['id'], (None, None))
+                    if future is None or future.done():
+                        continue
+                    if 'error' in message:
+                        future.set_exception(CDPError(message['error'].get('message', 'Unknown CDP error')))
+                    else:
+                        future.set_result(message.get('result', {}))
+                    continue
+
+                method = message.get('method')
+                params = message.get('params', {})
+                if method == 'Target.detachedFromTarget':
+                    self.forget_session(params.get('sessionId'), "Tab detached")
+                    continue
+                if method == 'Inspector.targetCrashed':
+                    self.forget_session(message.get('sessionId'), "Tab crashed")
+                    continue
+                for future in self._waiters.pop((message.get('sessionId'), method), []):
+                    if not future.done():
+                        future.set_result(params)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.closed = True
+            self._fail_all("Browser connection closed")
+
+    def _fail_all(self, reason):
+        for _, future in self._pending.values():
+            if not future.done():
+                future.set_exception(CDPError(reason))
+        self._pending.clear()
+        for futures in self._waiters.values():
+            for future in futures:
+                if not future.done():
+                    future.set_exception(CDPError(reason))
+        self._waiters.clear()
+
+    def forget_session(self, session_id, reason):
+        for msg_id, (owner, future) in list(self._pending.items()):
+            if owner == session_id:
+                del self._pending[msg_id]
+                if not future.done():
+                    future.set_exception(CDPError(reason))
+        for key in [key for key in self._waiters if key[0] == session_id]:
+            for future in self._waiters.pop(key):
+                if not future.done():
+                    future.set_exception(CDPError(reason))
+
+    async def send(self, method, params=None, session_id=None):
+        if self.closed:
+            raise CDPError("Browser connection closed")
+        msg_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[msg_id] = (session_id, future)
+        payload = {'id': msg_id, 'method': method, 'params': params or {}}
+        if session_id:
+            payload['sessionId'] = session_id
+        try:
+            await self.ws.send(json.dumps(payload))
+        except websockets.ConnectionClosed:
+            self._pending.pop(msg_id, None)
+            raise CDPError("Browser connection closed")
+        return await future
+
+    def wait_for_event(self, method, session_id=None):
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[(session_id, method)].append(future)
+        return future
+
+    async def close(self):
+        await self.ws.close()
+        await self._reader
+
+
+class _Tab:
+    def __init__(self, browser, target_id, session_id):
+        self.browser = browser
+        self.target_id = target_id
+        self.session_id = session_id
+        self.pages = 0
+
+    async def send(self, method, params=None):
+        return await self.browser.connection.send(method, params, self.session_id)
+
+    async def screenshot(self, url):
+        loaded = self.browser.connection.wait_for_event('Page.loadEventFired', self.session_id)
+        result = await self.send('Page.navigate', {'url': url})
+        if result.get('errorText'):
+            loaded.cancel()
+            raise CDPError(result['errorText'])
+        await loaded
+        result = await self.send('Page.captureScreenshot', {'format': 'png'})
+        self.pages += 1
+        return base64.b64decode(result['data'])
+
+    async def close(self):
+        try:
+            await self.browser.connection.send('Target.closeTarget', {'targetId': self.target_id})
+        except CDPError:
+            pass
+        self.browser.connection.forget_session(self.session_id, "Tab closed")
+
+
+class _Browser:
+    def __init__(self, process, user_data_dir, connection):
+        self.process = process
+        self.user_data_dir = user_data_dir
+        self.connection = connection
+
+    @classmethod
+    async def launch(cls, chrome_path, window_size, startup_timeout=30):
+        user_data_dir = tempfile.mkdtemp(prefix="cdp_capture_")
+        args = [chrome_path, *BROWSER_ARGS, f'--window-size={window_size[0]},{window_size[1]}',
+                f'--user-data-dir={user_data_dir}', 'about:blank']
+        process = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        # Chrome writes the port it picked and the browser endpoint path here once it is listening.
+        port_file = os.path.join(user_data_dir, "DevToolsActivePort")
+        deadline = time.monotonic() + startup_timeout
+        while True:
+            if os.path.exists(port_file):
+                with open(port_file, 'r', encoding='utf-8') as f:
+                    lines = f.read().split()
+                if len(lines) >= 2:
+                    break
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                shutil.rmtree(user_data_dir, ignore_errors=True)
+                raise CDPError(f"Chrome did not start: {chrome_path}")
+            await asyncio.sleep(0.05)
+
+        ws = await websockets.connect(f"ws://127.0.0.1:{lines[0]}{lines[1]}", max_size=None)
+        return cls(process, user_data_dir, _Connection(ws))
+
+    async def new_tab(self, window_size):
+        target = await self.connection.send('Target.createTarget', {'url': 'about:blank'})
+        attached = await self.connection.send('Target.attachToTarget',
+                                              {'targetId': target['targetId'], 'flatten': True})
+        tab = _Tab(self, target['targetId'], attached['sessionId'])
+        await tab.send('Page.enable')
+        # Without this Chrome never sends Inspector.targetCrashed, and a crash looks like a load timeout.
+        await tab.send('Inspector.enable')
+        await tab.send('Emulation.setDeviceMetricsOverride', {
+            'width': window_size[0],
+            'height': window_size[1],
+            'deviceScaleFactor': 1,
+            'mobile': False,
+        })
+        return tab
+
+    async def close(self):
+        try:
+            await asyncio.wait_for(self.connection.send('Browser.close'), 5)
+        except (CDPError, asyncio.TimeoutError):
+            pass
+        await self.connection.close()
+        # Wait off the event loop, so tabs on the other browsers keep going during a relaunch.
+        try:
+            await asyncio.to_thread(self.process.wait, 5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            await asyncio.to_thread(self.process.wait)
+        shutil.rmtree(self.user_data_dir, ignore_errors=True)
+
+
+class CDPCaptureEngine:
+    """Screenshot pages through the DevTools protocol with many tabs in flight.
+
+    Drop-in for ``VisualAnalyzer.capture_screenshot``; ``capture_many`` runs a
+    whole batch concurrently, bounded by ``max_tabs`` across ``browsers``
+    Chrome processes. Tabs are reused and recycled after ``max_pages_per_tab``,
+    and a browser that dies is relaunched; ``report`` prints the launch counts.
+    """
+
+    def __init__(self, browsers=1, max_tabs=8, max_pages_per_tab=50, page_load_timeout=60,
+                 window_size=(1920, 1080), chrome_path=None):
+        self.num_browsers = browsers
+        self.max_tabs = max_tabs
+        self.max_pages_per_tab = max_pages_per_tab
+        self.page_load_timeout = page_load_timeout
+        self.window_size = window_size
+        self.chrome_path = chrome_path or find_chrome_binary()
+        self._loop = asyncio.new_event_loop()
+        self._browsers = []
+        self._next_browser = itertools.cycle(range(browsers))
+        self._idle_tabs = []
+        self._semaphore = None
+        self._relaunch_locks = []
+        self.captured = 0
+        self.failed = 0
+        self.restarts = Counter()
+        self.restart_seconds = Counter()
+
+    async def _start(self):
+        if self._browsers:
+            return
+        self._browsers = [await self._launch("startup") for _ in range(self.num_browsers)]
+        self._semaphore = asyncio.Semaphore(self.max_tabs)
+        self._relaunch_locks = [asyncio.Lock() for _ in range(self.num_browsers)]
+
+    async def _launch(self, reason):
+        started = time.monotonic()
+        browser = await _Browser.launch(self.chrome_path, self.window_size)
+        self.restarts[reason] += 1
+        self.restart_seconds[reason] += time.monotonic() - started
+        return browser
+
+    async def _acquire_tab(self):
+        while self._idle_tabs:
+            tab = self._idle_tabs.pop()
+            if not tab.browser.connection.closed:
+                return tab
+        index = next(self._next_browser)
+        browser = self._browsers[index]
+        if browser.connection.closed:
+            async with self._relaunch_locks[index]:
+                # Every tab that saw the dead browser waits here; only the first one relaunches it.
+                if self._browsers[index] is browser:
+                    print("Browser process died, relaunching...")
+                    await browser.close()
+                    self._browsers[index] = await self._launch("browser died")
+            browser = self._browsers[index]
+        return await browser.new_tab(self.window_size)
+
+    async def _release_tab(self, tab, healthy):
+        if healthy and tab.pages < self.max_pages_per_tab:
+            self._idle_tabs.append(tab)
+        else:
+            await tab.close()
+
+    async def _capture(self, file_path, save_path, max_retries):
+        url = Path(file_path).resolve().as_uri()
+        async with self._semaphore:
+            for attempt in range(max_retries):
+                tab = None
+                png = None
+                try:
+                    tab = await self._acquire_tab()
+                    png = await asyncio.wait_for(tab.screenshot(url), self.page_load_timeout)
+                except asyncio.TimeoutError:
+                    print(f"Timeout: {file_path} took too long to load (attempt {attempt + 1}).")
+                except CDPError as e:
+                    print(f"CDP error for {file_path} (attempt {attempt + 1}): {str(e)}")
+                finally:
+                    if tab is not None:
+                        await self._release_tab(tab, png is not None)
+                if png is not None:
+                    with open(save_path, 'wb') as f:
+                        f.write(png)
+                    self.captured += 1
+                    return save_path
+        self.failed += 1
+        print(f"Failed to capture screenshot for {file_path} after {max_retries} attempts.")
+        return None
+
+    def _run(self, coro):
+        async def started():
+            await self._start()
+            return await coro
+        return self._loop.run_until_complete(started())
+
+    def capture_screenshot(self, file_path, save_path, max_retries=3):
+        if self._run(self._capture(file_path, save_path, max_retries)) is None:
+            return None
+        return Image.open(save_path)
+
+    def capture_many(self, jobs, max_retries=3):
+        """Capture ``(file_path, save_path)`` pairs; returns the saved path or None for each."""
+        async def capture_all():
+            return await asyncio.gather(*(self._capture(file_path, save_path, max_retries)
+                                          for file_path, save_path in jobs))
+        return self._run(capture_all())
+
+    def report(self):
+        relaunches = sum(self.restarts.values()) - self.restarts["startup"]
+        print(f"CDP capture: {self.captured} pages captured, {self.failed} failed, {relaunches} browser relaunches")
+        report_restarts(self.restarts, self.restart_seconds)
+
+    def close(self):
+        self.report()
+
+        async def shutdown():
+            for tab in self._idle_tabs:
+                await tab.close()
+            self._idle_tabs = []
+            for browser in self._browsers:
+                await browser.close()
+            self._browsers = []
+        self._loop.run_until_complete(shutdown())
+        self._loop.close()
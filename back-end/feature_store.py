@@ -0,0 +1,71 @@
+import json
+import os
+
+import numpy as np
+
+
+class FeatureStore:
+    """Preallocated memory-mapped matrix that feature vectors are written into as pages finish.
+
+    The matrix lives in ``<path>.npy``, optionally as float16, with one row per
+    page; ``paths[i]`` names the page in row ``i`` and is saved to
+    ``<path>.json`` by ``flush``. ``add`` swaps a page's vector for a view of
+    its row, so the only full copy is the file-backed one.
+    """
+
+    def __init__(self, path, capacity, dtype=np.float32):
+        self.path = path
+        self.capacity = capacity
+        self.dtype = np.dtype(dtype)
+        self.paths = []
+        self._matrix = None
+
+    @property
+    def matrix_path(self):
+        return f"{self.path}.npy"
+
+    @property
+    def index_path(self):
+        return f"{self.path}.json"
+
+    def __len__(self):
+        return len(self.paths)
+
+    @property
+    def features(self):
+        if self._matrix is None:
+            return np.zeros((0, 0), dtype=self.dtype)
+        return self._matrix[:len(self.paths)]
+
+    def add(self, data):
+        vector = np.asarray(data['visual_features']).ravel()
+        if self._matrix is None:
+            os.makedirs(os.path.dirname(self.matrix_path) or '.', exist_ok=True)
+            # The vector length is only known once the first page has been through the model.
+            self._matrix = np.lib.format.open_memmap(self.matrix_path, mode='w+', dtype=self.dtype,
+                                                     shape=(self.capacity, len(vector)))
+        row = len(self.paths)
+        if row >= self.capacity:
+            raise IndexError(f"Feature store is full ({self.capacity} rows)")
+        self._matrix[row] = vector
+        self.paths.append(data['path'])
+        data['visual_features'] = self._matrix[row]
+        return row
+
+    def flush(self):
+        if self._matrix is None:
+            np.save(self.matrix_path, np.zeros((0, 0), dtype=self.dtype))
+        else:
+            self._matrix.flush()
+        with open(self.index_path, 'w', encoding='utf-8') as f:
+            json.dump({'rows': len(self.paths), 'dtype': self.dtype.name, 'paths': self.paths}, f)
+
+    @classmethod
+    def open(cls, path):
+        """Reopen a flushed store read-only; ``features`` is memory-mapped, not loaded."""
+        with open(f"{path}.json", 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        store = cls(path, index['rows'], index['dtype'])
+        store.paths = index['paths']
+        store._matrix = np.load(store.matrix_path, mmap_mode='r')
+        return store
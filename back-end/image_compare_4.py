@@ -6,26 +6,39 @@ from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
 from selenium.common.exceptions import WebDriverException, TimeoutException
-from sklearn.cluster import DBSCAN
 from sklearn.metrics.pairwise import cosine_similarity
 from tensorflow.keras.applications import VGG16
 from tensorflow.keras.preprocessing import image
 from tensorflow.keras.applications.vgg16 import preprocess_input
 from sentence_transformers import SentenceTransformer
 from collections import defaultdict
+import argparse
 import re
 from nltk.corpus import stopwords
 from nltk.stem import PorterStemmer
 import nltk
+from browser_session import BrowserSessionManager, find_chromedriver
+from manifest import write_manifest
+from similarity import ARRAYS_NAME, cluster_medoids, cluster_representatives, write_cluster_arrays
+from thresholds import ThresholdExplorer
+from triage import DEFAULT_THRESHOLD as TRIAGE_THRESHOLD, MODES as TRIAGE_MODES, cluster_triage, triage_medoids
+from feature_store import FeatureStore
+from shards import (clear_shards, cluster_labels, load_shards, parse_shard, run_local_workers, shard_of,
+                    shard_store_path, write_shard)
 
 nltk.download('stopwords')
+stop_words = set(stopwords.words('english'))
+stemmer = PorterStemmer()
 
 visual_model = VGG16(weights='imagenet', include_top=False)
 text_model = SentenceTransformer('all-MiniLM-L6-v2')
 
+SCREENSHOT_DIR = "website_screenshots_t4"
+
 class VisualAnalyzer:
-    def __init__(self):
-        self.driver = self._initialize_driver()
+    def __init__(self, capture_engine=None):
+        self.capture_engine = capture_engine
+        self.driver = None if capture_engine else self._initialize_driver()
 
     def _get_browser_options(self):
         options = Options()
@@ -42,14 +55,15 @@ class VisualAnalyzer:
         return options
 
     def _initialize_driver(self):
-        chrome_driver_path = r"C:\Users\draghi\Desktop\chromedriver-win64\chromedriver.exe"
         options = self._get_browser_options()
-        service = Service(chrome_driver_path, log_path="chromedriver.log")
+        service = Service(find_chromedriver(), log_path="chromedriver.log")
         driver = webdriver.Chrome(service=service, options=options)
         driver.set_page_load_timeout(60)
         return driver
 
     def capture_screenshot(self, file_path, save_path, max_retries=3):
+        if self.capture_engine:
+            return self.capture_engine.capture_screenshot(file_path, save_path, max_retries)
         for attempt in range(max_retries):
             try:
                 self.driver.set_page_load_timeout(60)
@@ -78,74 +92,95 @@ class VisualAnalyzer:
             return np.zeros((25088,))
 
     def close(self):
-        self.driver.quit()
+        if self.driver:
+            self.driver.quit()
 
-def extract_structure(html):
-    soup = BeautifulSoup(html, 'html.parser')
+def extract_structure(soup):
     structure = []
     for tag in soup.find_all(True):
         depth = len(list(tag.parents))
         structure.append(f"{tag.name}:{depth}")
     return ' '.join(structure)
 
-def extract_classes(html):
-    soup = BeautifulSoup(html, 'html.parser')
+def extract_classes(soup):
     classes = set()
     for element in soup.find_all(class_=True):
         classes.update(element['class'])
     return classes
 
-def extract_text(html):
-    soup = BeautifulSoup(html, 'html.parser')
+def extract_text(soup):
+    # Removes script and style tags from the soup, so call it after the other extractors.
     for script in soup(["script", "style"]):
         script.decompose()
     text = soup.get_text()
     text = re.sub(r'[^\w\s]', '', text.lower())
     tokens = text.split()
-    stop_words = set(stopwords.words('english'))
-    ps = PorterStemmer()
-    filtered = [ps.stem(word) for word in tokens if word not in stop_words]
+    filtered = [stemmer.stem(word) for word in tokens if word not in stop_words]
     return ' '.join(filtered)
 
 def process_file(file_path):
     with open(file_path, 'r', encoding='utf-8') as f:
         html = f.read()
+    soup = BeautifulSoup(html, 'html.parser')
     return {
         'path': file_path,
-        'structure': extract_structure(html),
-        'classes': extract_classes(html),
-        'text': extract_text(html)
+        'structure': extract_structure(soup),
+        'classes': extract_classes(soup),
+        'text': extract_text(soup)
     }
 
+def try_process_file(file_path):
+    try:
+        return process_file(file_path)
+    except Exception as e:
+        print(f"Error processing {file_path}: {str(e)}")
+        return None
+
 def get_text_embedding(text_str):
     return text_model.encode(text_str)
 
 class WebsiteClusterer:
-    def __init__(self):
-        self.visual_analyzer = VisualAnalyzer()
-        self.screenshot_dir = "website_screenshots_t4"
+    def __init__(self, capture_engine=None, max_pages_per_session=200, max_session_memory_mb=2048):
+        self.capture_engine = capture_engine
+        if capture_engine:
+            # The engine relaunches its own browsers, so a session manager would only restart a driverless analyzer.
+            self.sessions = None
+            self.visual_analyzer = VisualAnalyzer(capture_engine)
+        else:
+            self.sessions = BrowserSessionManager(lambda: VisualAnalyzer(capture_engine),
+                                                  max_pages=max_pages_per_session,
+                                                  max_memory_mb=max_session_memory_mb)
+        self.screenshot_dir = SCREENSHOT_DIR
         os.makedirs(self.screenshot_dir, exist_ok=True)
+
+    def screenshot_path(self, file_path):
+        return os.path.join(self.screenshot_dir, f"{os.path.basename(file_path)}.png")
         
-    def process_website(self, file_path):
-        try:
-            data = process_file(file_path)
-            screenshot_path = os.path.join(self.screenshot_dir, f"{os.path.basename(file_path)}.png")
-            screenshot = self.visual_analyzer.capture_screenshot(file_path, screenshot_path)
-            
-            if screenshot is None:
-                print(f"Skipping {file_path} due to screenshot capture failure.")
+    def process_website(self, file_path, captured=False):
+        data = try_process_file(file_path)
+        if data is None:
+            return None
+        screenshot_path = self.screenshot_path(file_path)
+
+        def render(visual_analyzer):
+            if not captured and visual_analyzer.capture_screenshot(file_path, screenshot_path) is None:
                 return None
-            
-            data['visual_features'] = self.visual_analyzer.extract_visual_features(screenshot_path)
+            data['visual_features'] = visual_analyzer.extract_visual_features(screenshot_path)
             data['text_embedding'] = get_text_embedding(data['text'])
-            
             return data
-        except Exception as e:
-            print(f"Error processing {file_path}: {str(e)}")
-            print("Restarting WebDriver...")
-            self.visual_analyzer.close()
-            self.visual_analyzer = VisualAnalyzer()
-            return None
+
+        if self.sessions is None:
+            # Pages the engine could not capture already used their retries in capture_many.
+            try:
+                result = render(self.visual_analyzer) if captured else None
+            except Exception as e:
+                print(f"Error processing {file_path}: {str(e)}")
+                result = None
+        else:
+            result = self.sessions.run(file_path, render)
+        if result is None:
+            print(f"Skipping {file_path} due to screenshot capture failure.")
+        return result
 
     def calculate_similarity(self, doc1, doc2):
         visual_sim = cosine_similarity([doc1['visual_features']], [doc2['visual_features']])[0][0]
@@ -155,15 +190,18 @@ class WebsiteClusterer:
         class_sim = len(class_set1 & class_set2) / len(class_set1 | class_set2) if len(class_set1 | class_set2) > 0 else 0
         return 0.4 * visual_sim + 0.3 * text_sim + 0.3 * class_sim
 
-    def cluster_websites(self, processed_data, similarity_threshold=0.7):
-        features = np.array([d['visual_features'] for d in processed_data])
-        clustering = DBSCAN(metric='cosine', eps=1-similarity_threshold, min_samples=1).fit(features)
-        return clustering.labels_
+    def cluster_websites(self, processed_data, similarity_threshold=0.7, features=None):
+        if features is None:
+            features = np.array([d['visual_features'] for d in processed_data])
+        return cluster_labels(features, similarity_threshold)
 
     def close(self):
-        self.visual_analyzer.close()
+        if self.sessions is not None:
+            self.sessions.close()
+        if self.capture_engine:
+            self.capture_engine.close()
 
-def save_clusters(clusters, output_dir):
+def save_clusters(clusters, output_dir, screenshot_dir=SCREENSHOT_DIR, representatives=None):
     os.makedirs(output_dir, exist_ok=True)
     
     for cluster_id, cluster in enumerate(clusters, 1):
@@ -173,35 +211,195 @@ def save_clusters(clusters, output_dir):
             f.write("=" * 40 + "\n")
             for doc in cluster:
                 f.write(f"- {os.path.relpath(doc['path'], output_dir)}\n")
+
+    write_manifest(clusters, output_dir, screenshot_dir, representatives)
                 
     print(f"Generated {len(clusters)} clusters in {output_dir}")
 
-def main(input_dir, output_dir):
+def group_by_label(processed_data, labels):
+    clusters = defaultdict(list)
+    for idx, label in enumerate(labels):
+        clusters[label].append(processed_data[idx])
+    return clusters.values()
+
+def write_results(processed_data, labels, output_dir, features):
+    # Medoids are found once from the feature rows and shared by the manifest and the arrays.
+    medoids = cluster_medoids(features, labels)
+    unrendered = np.flatnonzero([not d.get('rendered', True) for d in processed_data])
+    if len(unrendered):
+        # Fallback clusters hold only unrendered pages, whose zero vectors say nothing, so use the triage signals.
+        fallback_medoids = triage_medoids([processed_data[row] for row in unrendered], np.asarray(labels)[unrendered])
+        medoids[unrendered] = unrendered[fallback_medoids]
+    representatives = [processed_data[row] for row in cluster_representatives(labels, medoids)]
+    save_clusters(group_by_label(processed_data, labels), output_dir, representatives=representatives)
+    write_cluster_arrays(output_dir, processed_data, labels, visual=features, medoids=medoids)
+
+def count_rendered(processed_data):
+    # load_shards puts the rendered pages first.
+    return sum(1 for d in processed_data if d['rendered'])
+
+def merge_shards(shard_dir, output_dir, num_shards=None, similarity_threshold=0.7):
+    processed_data, features = load_shards(shard_dir, num_shards)
+    rendered = count_rendered(processed_data)
+    labels = cluster_labels(features[:rendered], similarity_threshold)
+    processed_data, labels = cluster_unrendered(processed_data[:rendered], labels, processed_data[rendered:])
+    write_results(processed_data, labels, output_dir, features)
+
+def prepare_unrendered(unrendered, store):
+    # Pages that never rendered get a zero visual vector, so they share the store and shards with the rest.
+    fallback_data = [data for data in map(try_process_file, unrendered) if data]
+    visual_dims = store.features.shape[1] if len(store) else 25088
+    for data in fallback_data:
+        data['rendered'] = False
+        data['visual_features'] = np.zeros((visual_dims,), dtype=np.float32)
+        data['text_embedding'] = get_text_embedding(data['text'])
+        store.add(data)
+    return fallback_data
+
+def cluster_unrendered(processed_data, labels, fallback_data):
+    # Pages that never rendered are grouped on structure, classes and text and added as clusters of their own.
+    if not fallback_data:
+        return processed_data, labels
+    print(f"Clustering {len(fallback_data)} unrendered pages without screenshots")
+    fallback_labels = cluster_triage(fallback_data, TRIAGE_MODES['triage'])
+    offset = labels.max() + 1 if len(labels) else 0
+    return processed_data + fallback_data, np.concatenate([labels, fallback_labels + offset])
+
+def explore_thresholds(shard_dir, output_dir, threshold=None, num_shards=None):
+    processed_data, features = load_shards(shard_dir, num_shards)
+    rendered = count_rendered(processed_data)
+    explorer = ThresholdExplorer(features[:rendered])
+    for candidate, num_clusters in explorer.summary(np.round(np.arange(0.5, 0.96, 0.05), 2)):
+        print(f"threshold {candidate:.2f}: {num_clusters} clusters")
+    recommended = explorer.recommend()
+    print(f"Recommended threshold: {recommended:.3f} ({explorer.num_clusters(recommended)} clusters)")
+
+    if threshold is not None and threshold < explorer.min_similarity:
+        print(f"Error: --threshold {threshold} is below the explored range, use at least {explorer.min_similarity}")
+    elif threshold is not None:
+        labels = explorer.labels(threshold)
+        processed_data, labels = cluster_unrendered(processed_data[:rendered], labels, processed_data[rendered:])
+        write_results(processed_data, labels, output_dir, features)
+
+def main(input_dir, output_dir, engine="selenium", browsers=1, max_tabs=8, shard=None, shard_dir=None,
+         similarity_threshold=0.7, max_pages_per_session=200, max_session_memory_mb=2048, mode="visual",
+         feature_dtype="float32"):
     if not os.path.exists(input_dir):
         raise FileNotFoundError(f"Input directory not found: {input_dir}")
     
-    clusterer = WebsiteClusterer()
-    
-    processed_data = []
+    html_files = []
     for root, _, files in os.walk(input_dir):
         for file in files:
             if file.endswith('.html'):
-                file_path = os.path.join(root, file)
-                data = clusterer.process_website(file_path)
-                if data:
-                    processed_data.append(data)
-    
-    labels = clusterer.cluster_websites(processed_data)
+                html_files.append(os.path.join(root, file))
+    if shard is not None:
+        shard_index, num_shards = shard
+        html_files = [file_path for file_path in html_files if shard_of(file_path, input_dir, num_shards) == shard_index]
+
+    if mode != "visual":
+        if shard is not None:
+            raise ValueError("--shard only applies to --mode visual")
+        processed_data = [data for data in map(try_process_file, html_files) if data]
+        labels = cluster_triage(processed_data, TRIAGE_MODES[mode], similarity_threshold)
+        # Nothing was rendered, so the manifest gets no screenshots.
+        medoids = triage_medoids(processed_data, labels, TRIAGE_MODES[mode])
+        representatives = [processed_data[row] for row in cluster_representatives(labels, medoids)]
+        save_clusters(group_by_label(processed_data, labels), output_dir, screenshot_dir=None,
+                      representatives=representatives)
+        # clusters.npz needs visual features; drop one a visual run left behind so it cannot contradict the manifest.
+        arrays_path = os.path.join(output_dir, ARRAYS_NAME)
+        if os.path.exists(arrays_path):
+            os.remove(arrays_path)
+        return
+
+    capture_engine = None
+    if engine == "cdp":
+        from cdp_capture import CDPCaptureEngine
+        capture_engine = CDPCaptureEngine(browsers=browsers, max_tabs=max_tabs)
+    clusterer = WebsiteClusterer(capture_engine, max_pages_per_session, max_session_memory_mb)
+    if shard is not None:
+        store_path = shard_store_path(shard_dir, shard_index, num_shards)
+    elif shard_dir:
+        # Keep this run's features so --merge and --explore can re-cluster without Chrome or VGG16.
+        # Only single-process files are replaced, so shards from --shard workers survive.
+        clear_shards(shard_dir, 1)
+        store_path = shard_store_path(shard_dir, 0, 1)
+    else:
+        store_path = os.path.join(output_dir, "visual_features")
+    # Each page's features go straight into one preallocated memory-mapped matrix.
+    store = FeatureStore(store_path, len(html_files), feature_dtype)
+
+    captured = set()
+    if capture_engine:
+        jobs = [(file_path, clusterer.screenshot_path(file_path)) for file_path in html_files]
+        results = capture_engine.capture_many(jobs)
+        captured = {file_path for file_path, result in zip(html_files, results) if result}
+
+    processed_data = []
+    unrendered = []
+    for file_path in html_files:
+        data = clusterer.process_website(file_path, captured=file_path in captured)
+        if data:
+            store.add(data)
+            processed_data.append(data)
+        else:
+            unrendered.append(file_path)
+    fallback_data = prepare_unrendered(unrendered, store)
+
+    if shard is not None:
+        write_shard(processed_data + fallback_data, shard_dir, shard_index, num_shards, store)
+        clusterer.close()
+        return
+    if shard_dir:
+        write_shard(processed_data + fallback_data, shard_dir, 0, 1, store)
     
-    clusters = defaultdict(list)
-    for idx, label in enumerate(labels):
-        clusters[label].append(processed_data[idx])
+    labels = clusterer.cluster_websites(processed_data, similarity_threshold, store.features[:len(processed_data)]) if processed_data else np.zeros(0, dtype=int)
+    processed_data, labels = cluster_unrendered(processed_data, labels, fallback_data)
     
-    save_clusters(clusters.values(), output_dir)
+    write_results(processed_data, labels, output_dir, store.features)
     
     clusterer.close()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["visual", *TRIAGE_MODES], default="visual",
+                        help="visual renders every page; structure, text and triage cluster the HTML alone")
+    parser.add_argument("--engine", choices=["selenium", "cdp"], default="selenium")
+    parser.add_argument("--browsers", type=int, default=1)
+    parser.add_argument("--max-tabs", type=int, default=8)
+    parser.add_argument("--max-pages-per-session", type=int, default=200)
+    parser.add_argument("--max-session-memory-mb", type=int, default=2048)
+    parser.add_argument("--feature-dtype", choices=["float32", "float16"], default="float32",
+                        help="storage type of the memory-mapped visual features; float16 halves their size")
+    parser.add_argument("--shard", type=parse_shard, help="process only slice I/N of the input and write a feature shard")
+    parser.add_argument("--merge", action="store_true", help="cluster the feature shards written by --shard workers")
+    parser.add_argument("--local-workers", type=int, default=0, help="run N shard workers on this machine, then merge")
+    parser.add_argument("--num-shards", type=int,
+                        help="which run --merge and --explore read when the shard directory holds several (1 = a plain run)")
+    parser.add_argument("--explore", action="store_true",
+                        help="report cluster counts per threshold from saved features; writes clusters only with --threshold")
+    parser.add_argument("--threshold", type=float, help="similarity threshold for clustering (default 0.7, or 0.5 for the HTML-only modes)")
+    args = parser.parse_args()
     INPUT_DIR = "../back-end/clones/tier4"
     OUTPUT_DIR = "../back-end/output_clusters_t4"
-    main(INPUT_DIR, OUTPUT_DIR)
+    SHARD_DIR = "../back-end/feature_shards_t4"
+    similarity_threshold = args.threshold
+    if similarity_threshold is None:
+        similarity_threshold = 0.7 if args.mode == "visual" else TRIAGE_THRESHOLD
+    if args.explore:
+        explore_thresholds(SHARD_DIR, OUTPUT_DIR, args.threshold, args.num_shards)
+    elif args.local_workers:
+        clear_shards(SHARD_DIR, args.local_workers)
+        run_local_workers(__file__, args.local_workers,
+                          ["--engine", args.engine, "--browsers", str(args.browsers), "--max-tabs", str(args.max_tabs),
+                           "--max-pages-per-session", str(args.max_pages_per_session),
+                           "--max-session-memory-mb", str(args.max_session_memory_mb),
+                           "--feature-dtype", args.feature_dtype])
+        merge_shards(SHARD_DIR, OUTPUT_DIR, num_shards=args.local_workers, similarity_threshold=similarity_threshold)
+    elif args.merge:
+        merge_shards(SHARD_DIR, OUTPUT_DIR, num_shards=args.num_shards, similarity_threshold=similarity_threshold)
+    else:
+        main(INPUT_DIR, OUTPUT_DIR, engine=args.engine, browsers=args.browsers, max_tabs=args.max_tabs,
+             shard=args.shard, shard_dir=SHARD_DIR, similarity_threshold=similarity_threshold,
+             max_pages_per_session=args.max_pages_per_session, max_session_memory_mb=args.max_session_memory_mb,
+             mode=args.mode, feature_dtype=args.feature_dtype)
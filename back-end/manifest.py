@@ -0,0 +1,46 @@
+import hashlib
+import json
+import os
+
+MANIFEST_NAME = "clusters.json"
+
+
+def write_manifest(clusters, output_dir, screenshot_dir, representatives=None):
+    """Write ``clusters.json`` next to the ``cluster_NNN.txt`` files.
+
+    Cluster ids match the text file numbering and every path is relative to
+    ``output_dir``, like the text files. ``version`` is a hash of the rest of
+    the manifest, so the front end can use it as an ETag. ``representatives``
+    holds one document per cluster, normally its medoid from
+    ``cluster_medoids``; without it the first member is used. ``screenshot``
+    is null when the representative never rendered or ``screenshot_dir`` is
+    None.
+    """
+    entries = []
+    total_documents = 0
+    for cluster_id, cluster in enumerate(clusters, 1):
+        representative = representatives[cluster_id - 1] if representatives is not None else cluster[0]
+        screenshot = None
+        if screenshot_dir is not None and representative.get('rendered', True):
+            screenshot_path = os.path.join(screenshot_dir, f"{os.path.basename(representative['path'])}.png")
+            screenshot = os.path.relpath(screenshot_path, output_dir)
+        entries.append({
+            'id': cluster_id,
+            'size': len(cluster),
+            'representative': os.path.relpath(representative['path'], output_dir),
+            'screenshot': screenshot,
+            'members': [os.path.relpath(doc['path'], output_dir) for doc in cluster],
+        })
+        total_documents += len(cluster)
+
+    body = json.dumps({'total_documents': total_documents, 'clusters': entries}, separators=(',', ':'))
+    version = hashlib.sha1(body.encode('utf-8')).hexdigest()[:16]
+    manifest = {'version': version, 'total_clusters': len(entries), 'total_documents': total_documents,
+                'clusters': entries}
+
+    output_path = os.path.join(output_dir, MANIFEST_NAME)
+    tmp_path = os.path.join(output_dir, f"tmp_{MANIFEST_NAME}")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, separators=(',', ':'))
+    os.replace(tmp_path, output_path)
+    return output_path
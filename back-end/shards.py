@@ -0,0 +1,218 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from feature_store import FeatureStore
+from similarity import similarity_blocks
+
+SHARD_PATTERN = re.compile(r"shard_(\d+)_of_(\d+)\.npz")
+STRING_COLUMNS = ('path', 'structure', 'text', 'classes')
+
+
+def parse_shard(value):
+    """argparse type for ``--shard I/N``."""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected I/N, got {value!r}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"Shard index must be in [0, {count}), got {value!r}")
+    return index, count
+
+
+def shard_of(file_path, input_dir, num_shards):
+    # Hash the path relative to the input dir so nodes with different mount points agree.
+    key = os.path.relpath(file_path, input_dir).replace(os.sep, '/')
+    digest = hashlib.md5(key.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % num_shards
+
+
+def shard_path(shard_dir, shard_index, num_shards):
+    return os.path.join(shard_dir, f"shard_{shard_index:03d}_of_{num_shards:03d}.npz")
+
+
+def shard_store_path(shard_dir, shard_index, num_shards):
+    # Visual features sit next to the shard as a FeatureStore so they can be memory-mapped.
+    return os.path.join(shard_dir, f"shard_{shard_index:03d}_of_{num_shards:03d}.features")
+
+
+def _stack(vectors):
+    if not vectors:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.stack(vectors).astype(np.float32, copy=False)
+
+
+def _pack_strings(strings):
+    # Fixed-width unicode arrays pad every row to the longest string, so store one utf-8 blob plus offsets.
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(data) for data in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def _unpack_strings(blob, offsets):
+    data = blob.tobytes()
+    return [data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+
+
+def write_shard(processed_data, shard_dir, shard_index, num_shards, store=None):
+    """Write one worker's pages; ``store`` is the FeatureStore already holding their visual features.
+
+    Pages that never rendered carry ``rendered=False`` and must come after
+    the rendered ones, so the rendered rows are a prefix of the matrix.
+    """
+    rendered = np.array([d.get('rendered', True) for d in processed_data], dtype=bool)
+    if np.any(rendered[1:] > rendered[:-1]):
+        raise ValueError("Unrendered pages must come after the rendered ones")
+    os.makedirs(shard_dir, exist_ok=True)
+    output_path = shard_path(shard_dir, shard_index, num_shards)
+    if store is None:
+        store = FeatureStore(shard_store_path(shard_dir, shard_index, num_shards), len(processed_data))
+        for d in processed_data:
+            store.add({'path': d['path'], 'visual_features': d['visual_features']})
+    if store.path != shard_store_path(shard_dir, shard_index, num_shards) or len(store) != len(processed_data):
+        raise ValueError("Feature store does not match the shard being written")
+    store.flush()
+
+    # Write under a temporary name so a merge never sees a half-written shard.
+    tmp_path = os.path.join(shard_dir, f"tmp_{os.path.basename(output_path)}")
+    arrays = {
+        'visual_rows': np.array(len(store)),
+        'rendered': rendered,
+        'text_embedding': _stack([d['text_embedding'] for d in processed_data]),
+    }
+    for column in STRING_COLUMNS:
+        if column == 'classes':
+            values = [json.dumps(sorted(d['classes'])) for d in processed_data]
+        else:
+            values = [d[column] for d in processed_data]
+        arrays[f'{column}_blob'], arrays[f'{column}_offsets'] = _pack_strings(values)
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, output_path)
+    print(f"Wrote shard {shard_index}/{num_shards} ({len(processed_data)} documents) to {output_path}")
+    return output_path
+
+
+def clear_shards(shard_dir, num_shards=None):
+    """Remove the shards of the run split ``num_shards`` ways, or of every run when None."""
+    count = f"{num_shards:03d}" if num_shards else "*"
+    for file in glob.glob(os.path.join(shard_dir, f"shard_*_of_{count}.*")):
+        os.remove(file)
+
+
+def load_shards(shard_dir, num_shards=None):
+    """Load every shard of one run; returns ``(processed_data, visual_features)``.
+
+    Rendered pages come first. A single shard's features are used in place,
+    memory-mapped and in run order. Several shards are merged, sorted by path
+    within the rendered and unrendered groups, into one preallocated
+    memory-mapped ``shard_merged_of_NNN.features.npy`` so the result does not
+    depend on how pages were sharded. Each document's ``visual_features`` is
+    a view into the returned matrix.
+    """
+    found = {}
+    for file in glob.glob(os.path.join(shard_dir, "shard_*_of_*.npz")):
+        match = SHARD_PATTERN.fullmatch(os.path.basename(file))
+        if not match:
+            continue
+        found.setdefault(int(match.group(2)), {})[int(match.group(1))] = file
+
+    if num_shards is None:
+        if len(found) != 1:
+            raise ValueError(f"Expected shards from exactly one run in {shard_dir}, found counts {sorted(found)}; "
+                             f"pick one with --num-shards")
+        num_shards = next(iter(found))
+    files = found.get(num_shards, {})
+    missing = [i for i in range(num_shards) if i not in files]
+    if missing:
+        raise FileNotFoundError(f"Missing shards {missing} of {num_shards} in {shard_dir}")
+
+    strings = {column: [] for column in STRING_COLUMNS}
+    visual_parts, text_embedding, rendered = [], [], []
+    for index in range(num_shards):
+        with np.load(files[index]) as shard:
+            if int(shard['visual_rows']) == 0:
+                continue
+            for column in STRING_COLUMNS:
+                strings[column].extend(_unpack_strings(shard[f'{column}_blob'], shard[f'{column}_offsets']))
+            text_embedding.append(shard['text_embedding'])
+            rendered.append(shard['rendered'])
+        visual_parts.append(FeatureStore.open(shard_store_path(shard_dir, index, num_shards)).features)
+    if not visual_parts:
+        return [], np.zeros((0, 0), dtype=np.float32)
+    rendered = np.concatenate(rendered)
+
+    if len(visual_parts) == 1:
+        order = list(range(len(strings['path'])))
+        visual = visual_parts[0]
+    else:
+        order = sorted(range(len(strings['path'])), key=lambda row: (not rendered[row], strings['path'][row]))
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        merged_path = os.path.join(shard_dir, f"shard_merged_of_{num_shards:03d}.features.npy")
+        visual = np.lib.format.open_memmap(merged_path, mode='w+', dtype=visual_parts[0].dtype,
+                                           shape=(len(order), visual_parts[0].shape[1]))
+        offset = 0
+        for part in visual_parts:
+            visual[rank[offset:offset + len(part)]] = part
+            offset += len(part)
+    text_embedding = np.concatenate(text_embedding)[order]
+    rendered = rendered[order]
+
+    processed_data = []
+    for row, source in enumerate(order):
+        processed_data.append({
+            'path': strings['path'][source],
+            'structure': strings['structure'][source],
+            'classes': set(json.loads(strings['classes'][source])),
+            'text': strings['text'][source],
+            'visual_features': visual[row],
+            'text_embedding': text_embedding[row],
+            'rendered': bool(rendered[row]),
+        })
+    return processed_data, visual
+
+
+def neighbour_graph(features, similarity_threshold, block_size=2048):
+    """Sparse graph joining every pair with cosine similarity >= threshold.
+
+    Similarities are computed a block of rows at a time, so memory stays at
+    ``block_size * n`` rather than ``n * n``.
+    """
+    rows, cols = [], []
+    for start, _, sims in similarity_blocks(features, block_size):
+        r, c = np.nonzero(sims >= similarity_threshold)
+        rows.append(r + start)
+        cols.append(c)
+    rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+    cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int64)
+    n = len(features)
+    return coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n, n)).tocsr()
+
+
+def cluster_labels(features, similarity_threshold=0.7):
+    # Connected components of the threshold graph are exactly DBSCAN(min_samples=1) clusters.
+    if len(features) == 0:
+        return np.zeros(0, dtype=np.int32)
+    _, labels = connected_components(neighbour_graph(features, similarity_threshold), directed=False)
+    return labels
+
+
+def run_local_workers(script_path, num_workers, extra_args=()):
+    """Run one worker process per shard on this machine, standing in for separate nodes."""
+    processes = [
+        subprocess.Popen([sys.executable, script_path, "--shard", f"{index}/{num_workers}", *extra_args])
+        for index in range(num_workers)
+    ]
+    failed = [index for index, process in enumerate(processes) if process.wait() != 0]
+    if failed:
+        raise RuntimeError(f"Shard workers failed: {failed}")
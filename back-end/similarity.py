@@ -0,0 +1,197 @@
+import os
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+# Same weighting as WebsiteClusterer.calculate_similarity.
+VISUAL_WEIGHT = 0.4
+TEXT_WEIGHT = 0.3
+CLASS_WEIGHT = 0.3
+
+ARRAYS_NAME = "clusters.npz"
+
+# Cap on one float32 block of rows, so wide VGG16 vectors get proportionally fewer rows per block.
+BLOCK_BYTES = 64 * 1024 * 1024
+
+
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+def row_norms(features, block_size=2048):
+    norms = np.empty(len(features), dtype=np.float32)
+    for start in range(0, len(features), block_size):
+        block = np.asarray(features[start:start + block_size], dtype=np.float32)
+        norms[start:start + block_size] = np.sqrt(np.einsum('ij,ij->i', block, block))
+    return norms
+
+
+def normalized_block(features, norms, start, stop):
+    # Always a copy, so dividing in place never writes through to a memory-mapped store.
+    block = np.array(features[start:stop], dtype=np.float32)
+    block_norms = norms[start:stop, None]
+    # Rows with zero norm are all zeros already and are left as they are.
+    return np.divide(block, block_norms, out=block, where=block_norms > 0)
+
+
+def similarity_blocks(features, block_size=2048):
+    """Yield ``(start, stop, sims)``: cosine similarities of a block of rows against every row.
+
+    Rows are converted to float32 one block at a time, so a float16 or
+    memory-mapped feature matrix is never copied whole.
+    """
+    n = len(features)
+    if n:
+        block_size = max(1, min(block_size, BLOCK_BYTES // (4 * max(np.shape(features[0])[-1], 1))))
+    norms = row_norms(features, block_size)
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        left = normalized_block(features, norms, start, stop)
+        sims = np.empty((stop - start, n), dtype=np.float32)
+        for inner in range(0, n, block_size):
+            inner_stop = min(inner + block_size, n)
+            sims[:, inner:inner_stop] = left @ normalized_block(features, norms, inner, inner_stop).T
+        yield start, stop, sims
+
+
+def medoid_index(vectors, rows=None, block_size=2048):
+    """Position (within ``rows`` when given) of the member most similar to all the others."""
+    # The sum of cosine similarities to every member is x_i . sum(x), so the medoid needs no pairwise matrix.
+    if rows is None:
+        vectors = vectors if hasattr(vectors, 'shape') else np.asarray(vectors)
+        rows = np.arange(len(vectors))
+
+    def blocks():
+        for start in range(0, len(rows), block_size):
+            yield normalize_rows(vectors[rows[start:start + block_size]])
+
+    total = sum(block.sum(axis=0) for block in blocks())
+    return int(np.argmax(np.concatenate([block @ total for block in blocks()])))
+
+
+def class_matrix(class_sets):
+    """Binary page x class matrix, so Jaccard overlaps become sparse products."""
+    vocabulary = {}
+    indices, indptr = [], [0]
+    for classes in class_sets:
+        indices.extend(vocabulary.setdefault(name, len(vocabulary)) for name in set(classes))
+        indptr.append(len(indices))
+    data = np.ones(len(indices), dtype=np.float32)
+    return csr_matrix((data, indices, indptr), shape=(len(class_sets), max(len(vocabulary), 1)))
+
+
+def _jaccard(intersection, sizes_a, sizes_b):
+    union = sizes_a + sizes_b - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+def cluster_ids(labels):
+    """1-based ids in order of first appearance, matching the cluster_NNN.txt numbering."""
+    labels = np.asarray(labels)
+    unique, first = np.unique(labels, return_index=True)
+    ordered = unique[np.argsort(first)]
+    lookup = {label: cluster_id for cluster_id, label in enumerate(ordered, 1)}
+    return np.array([lookup[label] for label in labels], dtype=np.int32)
+
+
+def cluster_medoids(visual, labels):
+    """Row index of each page's cluster medoid, computed from the (possibly memory-mapped) feature rows."""
+    ids = cluster_ids(labels)
+    medoids = np.zeros(len(ids), dtype=np.int64)
+    if len(ids) == 0:
+        return medoids
+    by_cluster = np.argsort(ids, kind='stable')
+    for members in np.split(by_cluster, np.flatnonzero(np.diff(ids[by_cluster])) + 1):
+        medoids[members] = members[medoid_index(visual, members)]
+    return medoids
+
+
+def cluster_representatives(labels, medoids):
+    """Medoid row of each cluster, in ``cluster_ids`` order."""
+    _, first = np.unique(cluster_ids(labels), return_index=True)
+    return medoids[first]
+
+
+def write_cluster_arrays(output_dir, processed_data, labels, visual=None, medoids=None, k=5, block_size=1024):
+    """Write per-page labels, medoid distances and top-k neighbours to ``clusters.npz``.
+
+    Neighbours are ranked by the weighted score ``calculate_similarity`` uses,
+    and the visual/text/class parts are stored alongside it. Everything is
+    computed a block of rows at a time and saved in one go; ``visual`` may be
+    a float16 or memory-mapped matrix. Pass ``medoids`` from
+    ``cluster_medoids`` to avoid computing them again. ``medoid_visual`` and
+    ``medoid_distance`` are NaN where the page or its medoid has no visual
+    features (an all-zero row).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, ARRAYS_NAME)
+    n = len(processed_data)
+    if n == 0:
+        # A tier with no usable pages still gets a file with every array, just empty.
+        np.savez(
+            output_path,
+            paths=np.zeros(0, dtype=str),
+            cluster_id=np.zeros(0, dtype=np.int32),
+            medoid=np.zeros(0, dtype=np.int64),
+            neighbours=np.zeros((0, 0), dtype=np.int64),
+            **{name: np.zeros(0, dtype=np.float32)
+               for name in ('medoid_distance', 'medoid_visual', 'medoid_text', 'medoid_classes')},
+            **{f'neighbour_{name}': np.zeros((0, 0), dtype=np.float32)
+               for name in ('score', 'visual', 'text', 'classes')},
+        )
+        return output_path
+    if visual is None:
+        visual = np.array([d['visual_features'] for d in processed_data])
+    text = normalize_rows([d['text_embedding'] for d in processed_data])
+    classes = class_matrix([d['classes'] for d in processed_data])
+    class_sizes = np.asarray(classes.sum(axis=1), dtype=np.float32).ravel()
+    ids = cluster_ids(labels)
+
+    if medoids is None:
+        medoids = cluster_medoids(visual, ids)
+    norms = row_norms(visual, block_size)
+    medoid_visual = np.empty(n, dtype=np.float32)
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        medoid_rows = normalize_rows(visual[medoids[start:stop]])
+        medoid_visual[start:stop] = np.einsum('ij,ij->i', normalized_block(visual, norms, start, stop), medoid_rows)
+    medoid_visual[(norms == 0) | (norms[medoids] == 0)] = np.nan
+    medoid_text = np.einsum('ij,ij->i', text, text[medoids])
+    medoid_intersection = np.asarray(classes.multiply(classes[medoids]).sum(axis=1), dtype=np.float32).ravel()
+    medoid_class = _jaccard(medoid_intersection, class_sizes, class_sizes[medoids])
+
+    k = max(min(k, n - 1), 0)
+    neighbours = np.full((n, k), -1, dtype=np.int64)
+    scores = {name: np.zeros((n, k), dtype=np.float32) for name in ('score', 'visual', 'text', 'classes')}
+    for start, stop, visual_sim in (similarity_blocks(visual, block_size) if k > 0 else ()):
+        text_sim = text[start:stop] @ text.T
+        intersection = (classes[start:stop] @ classes.T).toarray()
+        class_sim = _jaccard(intersection, class_sizes[start:stop, None], class_sizes[None, :])
+        combined = VISUAL_WEIGHT * visual_sim + TEXT_WEIGHT * text_sim + CLASS_WEIGHT * class_sim
+
+        rows = np.arange(stop - start)
+        combined[rows, rows + start] = -np.inf
+        top = np.argpartition(-combined, k - 1, axis=1)[:, :k]
+        top = np.take_along_axis(top, np.argsort(-np.take_along_axis(combined, top, axis=1), axis=1), axis=1)
+        neighbours[start:stop] = top
+        for name, sim in (('score', combined), ('visual', visual_sim), ('text', text_sim), ('classes', class_sim)):
+            scores[name][start:stop] = np.take_along_axis(sim, top, axis=1)
+
+    np.savez(
+        output_path,
+        paths=np.array([os.path.relpath(d['path'], output_dir) for d in processed_data], dtype=str),
+        cluster_id=ids,
+        medoid=medoids,
+        medoid_distance=(1 - medoid_visual).astype(np.float32),
+        medoid_visual=medoid_visual.astype(np.float32),
+        medoid_text=medoid_text.astype(np.float32),
+        medoid_classes=medoid_class,
+        neighbours=neighbours,
+        neighbour_score=scores['score'],
+        neighbour_visual=scores['visual'],
+        neighbour_text=scores['text'],
+        neighbour_classes=scores['classes'],
+    )
+    return output_path
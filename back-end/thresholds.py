@@ -0,0 +1,96 @@
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components, minimum_spanning_tree
+
+from similarity import similarity_blocks
+
+# Sparse graphs drop zero weights, so identical pages need a nudge to keep their edge.
+_DISTANCE_OFFSET = 1e-9
+
+# Candidate edges held at once before they are folded into the spanning forest.
+EDGE_BUDGET = 1 << 22
+
+
+def _spanning_forest(num_pages, rows, cols, distances):
+    tree = minimum_spanning_tree(coo_matrix((distances, (rows, cols)), shape=(num_pages, num_pages))).tocoo()
+    return [tree.row], [tree.col], [tree.data]
+
+
+class ThresholdExplorer:
+    """Single-linkage hierarchy over one neighbour graph.
+
+    DBSCAN with ``min_samples=1`` and ``eps = 1 - threshold`` joins exactly the
+    pages linked by spanning-tree edges with similarity >= threshold, so once
+    the tree is built every threshold above ``min_similarity`` is a cheap cut.
+    Edges are merged into the forest Kruskal-style whenever ``EDGE_BUDGET``
+    of them are pending, so memory stays linear in the number of pages.
+    """
+
+    def __init__(self, features, min_similarity=0.5, block_size=2048):
+        self.num_pages = len(features)
+        self.min_similarity = min_similarity
+
+        rows, cols, distances = [], [], []
+        pending = 0
+        step = max(1, EDGE_BUDGET // max(self.num_pages, 1))
+        for start, _, block in similarity_blocks(features, block_size):
+            for offset in range(0, len(block), step):
+                first = start + offset
+                chunk = block[offset:offset + step]
+                r, c = np.nonzero(chunk >= min_similarity)
+                upper = c > r + first
+                rows.append(r[upper] + first)
+                cols.append(c[upper])
+                distances.append(np.clip(1 - chunk[r[upper], c[upper]].astype(np.float64), 0, None) + _DISTANCE_OFFSET)
+                pending += np.count_nonzero(upper)
+                if pending >= EDGE_BUDGET:
+                    # Edges dropped here close a cycle of cheaper ones, so they are not in the final tree either.
+                    rows, cols, distances = _spanning_forest(self.num_pages, np.concatenate(rows),
+                                                             np.concatenate(cols), np.concatenate(distances))
+                    pending = len(rows[0])
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+        cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int64)
+        distances = np.concatenate(distances) if distances else np.zeros(0, dtype=np.float64)
+
+        (tree_rows,), (tree_cols,), (tree_data,) = _spanning_forest(self.num_pages, rows, cols, distances)
+        order = np.argsort(tree_data)
+        self.edge_rows = tree_rows[order]
+        self.edge_cols = tree_cols[order]
+        # Descending: the similarity at which each merge happens.
+        self.edge_similarity = 1 - (tree_data[order] - _DISTANCE_OFFSET)
+
+    def _check(self, threshold):
+        if threshold < self.min_similarity:
+            raise ValueError(f"Threshold {threshold} is below the explored range (min_similarity={self.min_similarity})")
+
+    def num_clusters(self, threshold):
+        self._check(threshold)
+        merges = np.count_nonzero(self.edge_similarity >= threshold)
+        return int(self.num_pages - merges)
+
+    def labels(self, threshold):
+        self._check(threshold)
+        keep = self.edge_similarity >= threshold
+        graph = coo_matrix((np.ones(np.count_nonzero(keep), dtype=np.int8),
+                            (self.edge_rows[keep], self.edge_cols[keep])),
+                           shape=(self.num_pages, self.num_pages))
+        _, labels = connected_components(graph, directed=False)
+        return labels
+
+    def summary(self, thresholds):
+        return [(float(threshold), self.num_clusters(threshold)) for threshold in thresholds]
+
+    def recommend(self, max_similarity=0.99, default=0.7):
+        """Cut in the middle of the widest gap between consecutive merge similarities.
+
+        A wide gap means no threshold inside it changes the clustering, so the
+        clusters on either side of it are the most stable ones the data offers.
+        """
+        heights = self.edge_similarity[(self.edge_similarity >= self.min_similarity) &
+                                       (self.edge_similarity <= max_similarity)]
+        if len(heights) == 0:
+            return default
+        heights = np.concatenate((heights, [self.min_similarity]))
+        gaps = heights[:-1] - heights[1:]
+        widest = int(np.argmax(gaps))
+        return float((heights[widest] + heights[widest + 1]) / 2)
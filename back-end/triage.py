@@ -0,0 +1,84 @@
+import numpy as np
+from scipy.sparse import coo_matrix, hstack
+from scipy.sparse.csgraph import connected_components
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+
+from similarity import cluster_ids
+
+# Non-visual share of calculate_similarity's weighting, plus the DOM structure.
+SIGNAL_WEIGHTS = {'structure': 0.4, 'classes': 0.3, 'text': 0.3}
+
+# Hashed TF-IDF cosines run lower than VGG16 ones; 0.5 reproduced the visual cluster counts on the sample tiers.
+DEFAULT_THRESHOLD = 0.5
+
+MODES = {
+    'structure': ('structure', 'classes'),
+    'text': ('text',),
+    'triage': ('structure', 'classes', 'text'),
+}
+
+
+def _documents(processed_data, signal):
+    if signal == 'classes':
+        return [' '.join(sorted(d['classes'])) for d in processed_data]
+    return [d[signal] for d in processed_data]
+
+
+def triage_vectors(processed_data, signals, n_features=2 ** 18):
+    """Sparse hashed TF-IDF rows, one weighted block per signal.
+
+    Each block is l2-normalized and scaled by the square root of its weight,
+    so a dot product between two rows is the weighted sum of per-signal
+    cosine similarities.
+    """
+    total = sum(SIGNAL_WEIGHTS[signal] for signal in signals)
+    blocks = []
+    for signal in signals:
+        vectorizer = HashingVectorizer(
+            n_features=n_features,
+            token_pattern=r"\S+",
+            lowercase=False,
+            # Pairs of consecutive tags capture nesting that single tags miss.
+            ngram_range=(1, 2) if signal == 'structure' else (1, 1),
+            alternate_sign=False,
+            norm=None,
+        )
+        counts = vectorizer.transform(_documents(processed_data, signal))
+        tfidf = TfidfTransformer(sublinear_tf=True).fit_transform(counts)
+        blocks.append(tfidf * np.sqrt(SIGNAL_WEIGHTS[signal] / total))
+    return hstack(blocks, format='csr', dtype=np.float32)
+
+
+def cluster_triage(processed_data, signals, similarity_threshold=DEFAULT_THRESHOLD, block_size=512):
+    """DBSCAN(min_samples=1)-equivalent labels from sparse similarities, no rendering needed."""
+    if not processed_data:
+        return np.zeros(0, dtype=np.int32)
+    vectors = triage_vectors(processed_data, signals)
+    n = vectors.shape[0]
+    rows, cols = [], []
+    for start in range(0, n, block_size):
+        sims = (vectors[start:start + block_size] @ vectors.T).tocoo()
+        keep = sims.data >= similarity_threshold
+        rows.append(sims.row[keep] + start)
+        cols.append(sims.col[keep])
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    graph = coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n, n))
+    _, labels = connected_components(graph, directed=False)
+    return labels
+
+
+def triage_medoids(processed_data, labels, signals=MODES['triage']):
+    """Row of each page's cluster medoid by triage similarity, for pages with no visual features."""
+    ids = cluster_ids(labels)
+    medoids = np.zeros(len(ids), dtype=np.int64)
+    if len(ids) == 0:
+        return medoids
+    vectors = triage_vectors(processed_data, signals)
+    by_cluster = np.argsort(ids, kind='stable')
+    for members in np.split(by_cluster, np.flatnonzero(np.diff(ids[by_cluster])) + 1):
+        block = vectors[members]
+        # Summed similarity to the other members is x . sum(x), as in medoid_index.
+        scores = block @ np.asarray(block.sum(axis=0)).ravel()
+        medoids[members] = members[int(np.argmax(scores))]
+    return medoids
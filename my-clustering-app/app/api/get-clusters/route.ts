@@ -1,51 +1,159 @@
 import { NextRequest, NextResponse } from "next/server";
 import path from "path";
 import fs from "fs/promises";
+import { createHash } from "crypto";
 
-async function directoryExists(dirPath: string): Promise<boolean> {
+const TIERS = ["1", "2", "3", "4"];
+const DEFAULT_PAGE_SIZE = 50;
+const MAX_PAGE_SIZE = 500;
+
+type ClusterEntry = {
+  id: number;
+  size: number;
+  representative: string | null;
+  screenshot: string | null;
+  members: string[];
+};
+
+type Manifest = {
+  version: string;
+  total_clusters: number;
+  total_documents: number;
+  clusters: ClusterEntry[];
+};
+
+// Parsed manifests stay in memory until the file on disk changes.
+const manifestCache = new Map<string, { mtimeMs: number; manifest: Manifest }>();
+
+async function statOrNull(filePath: string) {
   try {
-    await fs.access(dirPath);
-    return true;
+    return await fs.stat(filePath);
   } catch {
-    return false;
+    return null;
+  }
+}
+
+// Output directories written before clusters.json existed only have cluster_NNN.txt files.
+async function buildLegacyManifest(dirPath: string): Promise<Manifest> {
+  const files = (await fs.readdir(dirPath)).filter((file) => /^cluster_\d+\.txt$/.test(file)).sort();
+  const clusters = await Promise.all(
+    files.map(async (file) => {
+      const content = await fs.readFile(path.join(dirPath, file), "utf-8");
+      const members = content
+        .split(/\r?\n/)
+        .filter((line) => line.startsWith("- "))
+        .map((line) => line.slice(2));
+      return {
+        id: parseInt(file.slice("cluster_".length), 10),
+        size: members.length,
+        representative: members[0] ?? null,
+        screenshot: null,
+        members,
+      };
+    })
+  );
+  const totalDocuments = clusters.reduce((acc, cluster) => acc + cluster.size, 0);
+  const version = createHash("sha1").update(JSON.stringify(clusters)).digest("hex").slice(0, 16);
+  return { version, total_clusters: clusters.length, total_documents: totalDocuments, clusters };
+}
+
+async function loadManifest(baseDir: string, tier: string): Promise<Manifest | null> {
+  const dirPath = path.join(baseDir, `output_clusters_t${tier}`);
+  const manifestPath = path.join(dirPath, "clusters.json");
+  const stat = (await statOrNull(manifestPath)) ?? (await statOrNull(dirPath));
+  if (!stat) {
+    console.warn(`Directory not found: ${dirPath}`);
+    return null;
+  }
+
+  const cacheKey = stat.isDirectory() ? dirPath : manifestPath;
+  const cached = manifestCache.get(cacheKey);
+  if (cached && cached.mtimeMs === stat.mtimeMs) {
+    return cached.manifest;
+  }
+
+  const manifest: Manifest = stat.isDirectory()
+    ? await buildLegacyManifest(dirPath)
+    : JSON.parse(await fs.readFile(manifestPath, "utf-8"));
+  manifestCache.set(cacheKey, { mtimeMs: stat.mtimeMs, manifest });
+  return manifest;
+}
+
+function parsePositiveInt(value: string | null, fallback: number): number {
+  const parsed = parseInt(value ?? "", 10);
+  return Number.isFinite(parsed) && parsed > 0 ? parsed : fallback;
+}
+
+function withETag(req: NextRequest, etag: string, body: object): NextResponse {
+  const headers = { ETag: etag, "Cache-Control": "no-cache" };
+  if (req.headers.get("if-none-match") === etag) {
+    return new NextResponse(null, { status: 304, headers });
   }
+  return NextResponse.json(body, { headers });
 }
 
+// GET /api/get-clusters                      -> per-tier summary (version, counts)
+// GET /api/get-clusters?tier=1&page=2        -> one page of clusters for a tier
+// GET /api/get-clusters?tier=1&cluster=7     -> a single cluster
 export async function GET(req: NextRequest): Promise<NextResponse> {
   try {
-    const clusterData: Record<string, { filename: string; content: string }[]> = {};
     const baseDir = process.env.BACKEND_DIR || path.join(process.cwd(), "../back-end");
-    let successCount = 0;
-
-    for (let tier = 1; tier <= 4; tier++) {
-      const dirPath = path.join(baseDir, `output_clusters_t${tier}`);
-
-      if (await directoryExists(dirPath)) {
-        try {
-          const files = await fs.readdir(dirPath);
-          const fileReadPromises = files
-            .filter((file) => file.endsWith(".txt"))
-            .map(async (file) => {
-              const filePath = path.join(dirPath, file);
-              const content = await fs.readFile(filePath, "utf-8");
-              return { filename: file, content };
-            });
-
-          const tierClusters = await Promise.all(fileReadPromises);
-          clusterData[`Tier ${tier}`] = tierClusters;
-          successCount++;
-        } catch (error) {
-          console.warn(`Error reading cluster files for Tier ${tier}:`, error);
+    const url = new URL(req.url);
+    const tier = url.searchParams.get("tier");
+
+    if (!tier) {
+      const tiers: Record<string, { version: string; totalClusters: number; totalDocuments: number }> = {};
+      for (const t of TIERS) {
+        const manifest = await loadManifest(baseDir, t);
+        if (manifest) {
+          tiers[`Tier ${t}`] = {
+            version: manifest.version,
+            totalClusters: manifest.total_clusters,
+            totalDocuments: manifest.total_documents,
+          };
         }
-      } else {
-        console.warn(`Directory not found: ${dirPath}`);
       }
+      const versions = Object.entries(tiers).map(([name, summary]) => `${name}:${summary.version}`);
+      const etag = `"${createHash("sha1").update(versions.join(",")).digest("hex").slice(0, 16)}"`;
+      return withETag(req, etag, { success: true, tiers, successCount: versions.length });
+    }
+
+    if (!TIERS.includes(tier)) {
+      return NextResponse.json({ success: false, error: "Invalid tier parameter" }, { status: 400 });
     }
 
-    const totalClusters = Object.values(clusterData).reduce((acc, tierClusters) => acc + tierClusters.length, 0);
-    return NextResponse.json({ success: true, clusters: clusterData, successCount, totalClusters });
+    const manifest = await loadManifest(baseDir, tier);
+    if (!manifest) {
+      return NextResponse.json({ success: false, error: `No clusters for tier ${tier}` }, { status: 404 });
+    }
+
+    const clusterParam = url.searchParams.get("cluster");
+    if (clusterParam !== null) {
+      const clusterId = parseInt(clusterParam, 10);
+      const cluster = manifest.clusters.find((entry) => entry.id === clusterId);
+      if (!cluster) {
+        return NextResponse.json({ success: false, error: `Cluster ${clusterParam} not found` }, { status: 404 });
+      }
+      const etag = `"${manifest.version}-c${clusterId}"`;
+      return withETag(req, etag, { success: true, tier: `Tier ${tier}`, version: manifest.version, cluster });
+    }
+
+    const page = parsePositiveInt(url.searchParams.get("page"), 1);
+    const pageSize = Math.min(parsePositiveInt(url.searchParams.get("pageSize"), DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE);
+    const start = (page - 1) * pageSize;
+    const etag = `"${manifest.version}-p${page}-${pageSize}"`;
+    return withETag(req, etag, {
+      success: true,
+      tier: `Tier ${tier}`,
+      version: manifest.version,
+      page,
+      pageSize,
+      totalClusters: manifest.total_clusters,
+      totalDocuments: manifest.total_documents,
+      clusters: manifest.clusters.slice(start, start + pageSize),
+    });
   } catch (error) {
     console.error("Failed to fetch clusters:", error);
     return NextResponse.json({ success: false, error: "Failed to fetch clusters" });
   }
-}
\ No newline at end of file
+}
@@ -2,10 +2,14 @@
 
 import React, { useState } from "react";
 
+type Cluster = { id: number; size: number; representative: string | null; screenshot: string | null; members: string[] };
+
+type TierClusters = { clusters: Cluster[]; page: number; totalClusters: number; version: string };
+
 const Dashboard = () => {
   const [loading, setLoading] = useState<number | null>(null);
   const [message, setMessage] = useState("");
-  const [clusters, setClusters] = useState<{ [key: string]: { filename: string; content: string }[] }>({});
+  const [clusters, setClusters] = useState<{ [key: string]: TierClusters }>({});
   const [showClusters, setShowClusters] = useState(false);
   const [selectedTier, setSelectedTier] = useState<string | null>(null);
 
@@ -23,7 +27,7 @@ const Dashboard = () => {
 
       if (data?.success) {
         setMessage(`✅ Tier ${tier} generated successfully!`);
-        fetchClusters();
+        fetchClusters(tier, 1);
       } else {
         setMessage(`❌ Error: ${data?.error || "Unknown error"}`);
       }
@@ -40,15 +44,28 @@ const Dashboard = () => {
     setLoading(null);
   };
 
-  const fetchClusters = async () => {
+  const fetchClusters = async (tier: number, page: number) => {
     try {
-      const response = await fetch("/api/get-clusters");
+      const response = await fetch(`/api/get-clusters?tier=${tier}&page=${page}`);
       const data = await response.json();
 
       console.log("API Response from get-clusters:", data);
 
       if (data?.success && data?.clusters) {
-        setClusters(data.clusters);
+        setClusters((previous) => {
+          const current = previous[data.tier];
+          // A new version means the tier was regenerated, so earlier pages are stale.
+          const keep = page > 1 && current?.version === data.version ? current.clusters : [];
+          return {
+            ...previous,
+            [data.tier]: {
+              clusters: [...keep, ...data.clusters],
+              page,
+              totalClusters: data.totalClusters,
+              version: data.version,
+            },
+          };
+        });
         setShowClusters(true);
       } else {
         console.error("Error fetching clusters:", data?.error || "Unknown error");
@@ -96,18 +113,28 @@ const Dashboard = () => {
         {showClusters && selectedTier && clusters[selectedTier] && (
           <div className="bg-white p-4 rounded shadow-md max-h-[calc(100vh-30%)]">
             <h2 className="text-2xl font-bold mb-4">Cluster Output for {selectedTier}</h2>
-            {clusters[selectedTier].length === 0 ? (
+            {clusters[selectedTier].clusters.length === 0 ? (
               <p>No clusters to display for {selectedTier}</p>
             ) : (
               <ul className="list-disc pl-5">
-                {clusters[selectedTier].map(({ filename, content }) => (
-                  <li key={filename} className="mt-2">
-                    <strong>{filename}:</strong>
-                    <pre className="bg-gray-200 p-2 rounded mt-1">{content}</pre>
+                {clusters[selectedTier].clusters.map(({ id, size, members }) => (
+                  <li key={id} className="mt-2">
+                    <strong>
+                      Cluster {id} ({size} documents):
+                    </strong>
+                    <pre className="bg-gray-200 p-2 rounded mt-1">{members.map((member) => `- ${member}`).join("\n")}</pre>
                   </li>
                 ))}
               </ul>
             )}
+            {clusters[selectedTier].clusters.length < clusters[selectedTier].totalClusters && (
+              <button
+                onClick={() => fetchClusters(Number(selectedTier.split(" ")[1]), clusters[selectedTier].page + 1)}
+                className="mt-4 px-4 py-2 rounded bg-gray-700 text-white font-semibold"
+              >
+                Load more ({clusters[selectedTier].clusters.length} of {clusters[selectedTier].totalClusters})
+              </button>
+            )}
           </div>
         )}
       </div>